@@ -4,13 +4,68 @@ Context Management System
 Manages conversation history and user preferences for chat applications.
 Maintains separate contexts per user to enable continuous conversations.
 """
+import asyncio
+import collections
+
+import orjson
+
+SUMMARY_PREFIX = "[earlier conversation summary: "
+
 class ContextManager:
     """Handles user-specific conversation context and model preferences."""
     
+    DEFAULT_MODEL = "google/gemini-2.0-flash-lite-preview-02-05:free"
+    
     def __init__(self):
         """Initialize empty context and model storage."""
-        self.contexts = {}  # {user_id: list of message dicts}
-        self.user_models = {}  # {user_id: model_name}
+        self.MAX_TURNS = 20  # Exchanges kept per user; older ones are dropped
+        self.MAX_USERS = 1000  # Users tracked before the least recently active is evicted
+        self.COMPACT_THRESHOLD = 30  # History length that triggers compaction
+        self.KEEP_RECENT = 10  # Messages kept verbatim when compacting
+        self.SUMMARY_EXCERPT_CHARS = 200  # Characters kept from each summarized message
+        self.SUMMARY_MAX_CHARS = 2000  # Cap on the summary, newest text wins
+        # Both maps are kept in least-recently-used order (oldest first)
+        self.contexts = collections.OrderedDict()  # {user_id: deque of message dicts}
+        self.context_bytes = {}  # {user_id: deque of JSON-encoded messages, mirrors contexts}
+        self.user_models = collections.OrderedDict()  # {user_id: model_name}
+        self._locks = {}  # {user_id: asyncio.Lock serializing that user's turns}
+
+    def _evict_idle_users(self):
+        """Drop least recently active users once ``MAX_USERS`` is exceeded."""
+        while len(self.contexts) > self.MAX_USERS:
+            user_id, _ = self.contexts.popitem(last=False)
+            self.context_bytes.pop(user_id, None)
+            self.user_models.pop(user_id, None)
+            self._drop_idle_lock(user_id)
+        while len(self.user_models) > self.MAX_USERS:
+            self.user_models.popitem(last=False)
+
+    def _drop_idle_lock(self, user_id):
+        """Forget a user's lock unless a turn is currently holding it."""
+        lock = self._locks.get(user_id)
+        if lock is not None and not lock.locked():
+            del self._locks[user_id]
+
+    def lock(self, user_id):
+        """Get the lock that serializes a user's turns.
+        
+        Different users proceed concurrently; messages from the same user are
+        handled one after another so each sees the previous reply in context.
+        
+        Args:
+            user_id (str): User identifier to lock
+            
+        Returns:
+            asyncio.Lock: Lock shared by all of the user's turns
+        """
+        lock = self._locks.get(user_id)
+        if lock is None:
+            if len(self._locks) >= self.MAX_USERS:
+                # Users whose turns all failed never reach the LRU, prune them here
+                for idle_user in [uid for uid in self._locks if uid not in self.contexts]:
+                    self._drop_idle_lock(idle_user)
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
 
     def update_context(self, user_id, user_message, bot_response):
         """Add new messages to a user's conversation history.
@@ -21,21 +76,93 @@ class ContextManager:
             bot_response (str): Assistant's generated response
         """
         if user_id not in self.contexts:
-            self.contexts[user_id] = []
+            # Bounded so old messages fall off instead of growing the payload forever
+            self.contexts[user_id] = collections.deque(maxlen=2 * self.MAX_TURNS)
+            self.context_bytes[user_id] = collections.deque(maxlen=2 * self.MAX_TURNS)
         # Maintain conversation flow with alternating roles
-        self.contexts[user_id].append({"role": "user", "content": user_message})
-        self.contexts[user_id].append({"role": "assistant", "content": bot_response})
+        for message in (
+            {"role": "user", "content": user_message},
+            {"role": "assistant", "content": bot_response},
+        ):
+            self.contexts[user_id].append(message)
+            # Encode once here so each turn doesn't re-serialize the whole history
+            self.context_bytes[user_id].append(orjson.dumps(message))
+        if len(self.contexts[user_id]) > self.COMPACT_THRESHOLD:
+            self._compact(user_id)
+        self.contexts.move_to_end(user_id)
+        self._evict_idle_users()
+
+    def _compact(self, user_id):
+        """Fold older messages into a single summary message.
+        
+        Keeps the last ``KEEP_RECENT`` messages verbatim and replaces the rest
+        with one system message of excerpts, so the history sent each turn
+        stays small however long the conversation runs.
+        
+        Args:
+            user_id (str): User whose history to compact
+        """
+        history = self.contexts[user_id]
+        older = list(history)[:-self.KEEP_RECENT]
+        excerpts = []
+        for message in older:
+            content = message["content"]
+            if not isinstance(content, str):
+                # APIs may return null (or structured) content, summarize it as text
+                content = "" if content is None else str(content)
+            if message["role"] == "system" and content.startswith(SUMMARY_PREFIX):
+                # Carry the previous summary forward
+                excerpts.append(content[len(SUMMARY_PREFIX):-1])
+            else:
+                excerpts.append(f"{message['role']}: {content[:self.SUMMARY_EXCERPT_CHARS]}")
+        summary = " | ".join(excerpts)[-self.SUMMARY_MAX_CHARS:]
+        
+        compacted = collections.deque(
+            [{"role": "system", "content": f"{SUMMARY_PREFIX}{summary}]"}],
+            maxlen=history.maxlen
+        )
+        compacted.extend(list(history)[-self.KEEP_RECENT:])
+        # Swap both views in together so they never disagree
+        self.contexts[user_id] = compacted
+        self.context_bytes[user_id] = collections.deque(
+            (orjson.dumps(message) for message in compacted),
+            maxlen=history.maxlen
+        )
 
     def get_context(self, user_id):
-        """Retrieve full conversation history for a user.
+        """Retrieve recent conversation history for a user.
+        
+        Args:
+            user_id (str): User identifier to fetch context for
+            
+        Returns:
+            deque: Recent messages in OpenAI message format, possibly led by
+                a summary of older ones. This is the stored history itself,
+                so don't mutate it.
+        """
+        if user_id not in self.contexts:
+            return ()
+        self.contexts.move_to_end(user_id)
+        return self.contexts[user_id]
+
+    def get_context_payload(self, user_id, user_message):
+        """Build the JSON ``messages`` array for a new turn.
+        
+        Reuses the cached encoding of the history, so only the new message
+        is serialized.
         
         Args:
             user_id (str): User identifier to fetch context for
+            user_message (str): User's new input message
             
         Returns:
-            list: Conversation history in OpenAI message format
+            bytes: JSON array of the history followed by the new message
         """
-        return self.contexts.get(user_id, [])
+        encoded = self.context_bytes.get(user_id, ())
+        if encoded:
+            self.contexts.move_to_end(user_id)
+        new_message = orjson.dumps({"role": "user", "content": user_message})
+        return b"[" + b",".join((*encoded, new_message)) + b"]"
 
     def clear_context(self, user_id):
         """Reset conversation history for a user.
@@ -44,7 +171,8 @@ class ContextManager:
             user_id (str): User identifier to clear context for
         """
         if user_id in self.contexts:
-            self.contexts[user_id] = []  # Maintain user entry but empty history
+            self.contexts[user_id].clear()  # Maintain user entry but empty history
+            self.context_bytes[user_id].clear()
 
     def set_user_model(self, user_id, model):
         """Store preferred AI model for a user.
@@ -54,6 +182,8 @@ class ContextManager:
             model (str): Model name from OpenRouter's supported models
         """
         self.user_models[user_id] = model
+        self.user_models.move_to_end(user_id)
+        self._evict_idle_users()
 
     def get_user_model(self, user_id):
         """Retrieve user's preferred model or return default.
@@ -64,4 +194,8 @@ class ContextManager:
         Returns:
             str: Model name configured for user or fallback default
         """
-        return self.user_models.get(user_id, "google/gemini-2.0-flash-lite-preview-02-05:free")
+        model = self.user_models.get(user_id)
+        if model is None:
+            return self.DEFAULT_MODEL
+        self.user_models.move_to_end(user_id)
+        return model
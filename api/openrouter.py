@@ -1,12 +1,23 @@
 """
 OpenRouter API Client Implementation
 
-Provides asynchronous and synchronous (legacy) interfaces for interacting with 
-the OpenRouter API. Handles chat completions, model listings, and error handling.
+Provides an asynchronous interface for interacting with the OpenRouter API.
+Handles chat completions, model listings, and error handling.
 """
 import aiohttp
-import json
 import asyncio
+import logging
+import time
+import orjson
+from aiolimiter import AsyncLimiter
+from bot.http import get_session
+
+try:
+    import httpx  # Optional HTTP/2 transport
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
 
 class OpenRouterAPI:
     """
@@ -14,9 +25,11 @@ class OpenRouterAPI:
     
     Features:
     - Async/Await support for non-blocking requests
+    - Application-wide pooled HTTP session reused across requests (keep-alive)
+    - Optional HTTP/2 transport via httpx for multiplexed requests
     - Automatic timeout handling (60s for chat, 30s for models)
+    - Client-side rate limiting of chat completions to avoid 429s
     - Detailed error logging and error response generation
-    - Backward-compatible sync methods (deprecated)
     
     Attributes:
         BASE_URL (str): Base URL for OpenRouter API endpoints
@@ -24,24 +37,135 @@ class OpenRouterAPI:
         headers (dict): Pre-configured request headers with auth
     """
     BASE_URL = "https://openrouter.ai/api/v1"
+    MODELS_CACHE_TTL = 300  # Seconds to reuse the /models catalog before refetching
     
-    def __init__(self, api_key):
+    def __init__(self, api_key, transport="aiohttp", rps=5):
         """Initialize API client with authentication credentials.
         
         Args:
             api_key (str): OpenRouter API key obtained from dashboard
+            transport (str): 'aiohttp' (HTTP/1.1 keep-alive) or 'httpx'
+                (HTTP/2, requires the httpx and h2 packages)
+            rps (float): Chat completion requests allowed per second,
+                sized to the key's OpenRouter plan
+        
+        Raises:
+            ValueError: If transport is not a supported backend or rps is
+                not positive
         """
         self.api_key = api_key
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        self._client = None  # httpx.AsyncClient when using the httpx transport
+        self._models_cache = None  # (fetched_at, models payload)
+        self._limiter = self._make_limiter(rps)
+        if transport == "httpx":
+            if httpx is None:
+                raise ValueError("The httpx transport requires the httpx package")
+            self._client = httpx.AsyncClient(
+                base_url=self.BASE_URL,
+                headers=self.headers,
+                http2=True,  # Multiplex concurrent requests over one connection
+                timeout=60,
+                limits=httpx.Limits(max_keepalive_connections=50, max_connections=100)
+            )
+        elif transport != "aiohttp":
+            raise ValueError(f"Unknown transport: {transport}")
+
+    async def _get_session(self):
+        """Return the application-wide aiohttp session.
+
+        Reusing it keeps connections to openrouter.ai alive between requests
+        instead of paying a fresh TCP + TLS handshake every time. The session
+        is shared, so auth headers are sent per request instead.
+
+        Returns:
+            aiohttp.ClientSession: Shared session from ``bot.http``
+        """
+        return get_session()
+
+    @staticmethod
+    def _make_limiter(rps):
+        """Build a limiter allowing ``rps`` requests per second.
+        
+        Args:
+            rps (float): Requests allowed per second, may be fractional
+            
+        Returns:
+            AsyncLimiter: Limiter whose capacity is at least one request
+            
+        Raises:
+            ValueError: If rps is not positive
+        """
+        if rps <= 0:
+            raise ValueError(f"rps must be positive, got {rps}")
+        if rps < 1:
+            # A capacity below 1 would reject every acquire(), so stretch
+            # the period instead (0.5 rps -> 1 request per 2 seconds)
+            return AsyncLimiter(1, 1 / rps)
+        return AsyncLimiter(rps, 1)
+
+    def set_rate(self, rps):
+        """Change the chat completion rate limit.
+        
+        Args:
+            rps (float): Requests allowed per second, may be fractional
+            
+        Raises:
+            ValueError: If rps is not positive
+        """
+        self._limiter = self._make_limiter(rps)
+
+    async def aclose(self):
+        """Close the httpx client, if any.
+
+        The shared aiohttp session is owned by ``bot.http`` and closed by
+        its ``close_session``.
+        """
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def _request(self, method, path, timeout, body=None):
+        """Send a request over the configured transport.
+        
+        Args:
+            method (str): HTTP method
+            path (str): Endpoint path relative to BASE_URL (e.g. '/models')
+            timeout (float): Total request timeout in seconds
+            body (bytes): Optional JSON-encoded request body
+            
+        Returns:
+            tuple: (status code, raw response body bytes)
+            
+        Raises:
+            asyncio.TimeoutError: If the request exceeds the timeout
+        """
+        if self._client is not None:
+            try:
+                response = await self._client.request(method, path, content=body, timeout=timeout)
+            except httpx.TimeoutException as e:
+                raise asyncio.TimeoutError() from e
+            return response.status_code, response.content
+        
+        session = await self._get_session()
+        async with session.request(
+            method,
+            f"{self.BASE_URL}{path}",
+            headers=self.headers,
+            data=body,
+            timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as response:
+            return response.status, await response.read()
     
     async def chat_completion_async(self, messages, model):
         """Execute asynchronous chat completion request.
         
         Args:
-            messages (list): Conversation history in OpenAI format
+            messages (list | bytes): Conversation history in OpenAI format,
+                or an already JSON-encoded messages array (see
+                ``ContextManager.get_context_payload``)
             model (str): Target model ID (e.g., 'gpt-3.5-turbo')
             
         Returns:
@@ -51,116 +175,62 @@ class OpenRouterAPI:
             aiohttp.ClientError: For network-level issues
             asyncio.TimeoutError: If request exceeds 60 seconds
         """
-        url = f"{self.BASE_URL}/chat/completions"
-        data = {
-            "model": model,
-            "messages": messages,
-            "max_tokens": 1000  # Prevent overly long responses
-        }
+        path = "/chat/completions"
+        max_tokens = 1000  # Prevent overly long responses
+        if not isinstance(messages, bytes):
+            messages = orjson.dumps(list(messages))
+        # Build the body directly so the encoded history is never re-serialized
+        body = (
+            b'{"model":' + orjson.dumps(model)
+            + b',"messages":' + messages
+            + b',"max_tokens":' + str(max_tokens).encode() + b"}"
+        )
         
         # Diagnostic logging - shows request metadata
-        print(f"[OpenRouter] Starting request to {url}")
-        print(f"[OpenRouter] Selected model: {model}")
+        logger.debug("Starting request to %s%s", self.BASE_URL, path)
+        logger.debug("Selected model: %s", model)
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    url, 
-                    headers=self.headers, 
-                    json=data,
-                    timeout=aiohttp.ClientTimeout(total=60)  # Fail fast if unresponsive
-                ) as response:
-                    # Process successful response
-                    print(f"[OpenRouter] Received status: {response.status}")
-                    response_json = await response.json()
-                    print(f"[OpenRouter] Response snippet: {str(response_json)[:200]}...")
-                    return response_json
-                    
+            # Wait for a slot rather than spend a round-trip on a 429
+            async with self._limiter:
+                # Fail fast if unresponsive
+                status, content = await self._request("POST", path, 60, body)
+            # Process successful response
+            logger.debug("Received status: %s (%d bytes)", status, len(content))
+            # orjson parses the raw bytes directly, no separate UTF-8 decode pass
+            return orjson.loads(content)
+            
         except asyncio.TimeoutError:
-            print("[OpenRouter] Timeout after 60 seconds")
+            logger.warning("Timeout after 60 seconds")
             return {"error": {"message": "Request timed out", "code": 408}}
         except Exception as e:
             # Catch-all for unexpected errors
-            print(f"[OpenRouter] Critical error: {str(e)}")
+            logger.exception("Critical error: %s", e)
             return {"error": {"message": f"Request failed: {str(e)}", "code": 500}}
     
     async def get_models_async(self):
         """Fetch list of available models from OpenRouter.
         
+        The catalog rarely changes, so a successful response is reused for
+        ``MODELS_CACHE_TTL`` seconds.
+        
         Returns:
             list/dict: Model list on success, error dict on failure
         """
-        url = f"{self.BASE_URL}/models"  # Models endpoint
+        now = time.monotonic()
+        if self._models_cache and now - self._models_cache[0] < self.MODELS_CACHE_TTL:
+            return self._models_cache[1]
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    url, 
-                    headers=self.headers,
-                    timeout=aiohttp.ClientTimeout(total=30)  # Shorter timeout for model list
-                ) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    else:
-                        print(f"[OpenRouter] Model fetch failed: HTTP {response.status}")
-                        return None
+            # Shorter timeout for model list
+            status, content = await self._request("GET", "/models", 30)
+            if status == 200:
+                models_data = orjson.loads(content)
+                self._models_cache = (now, models_data)
+                return models_data
+            else:
+                logger.warning("Model fetch failed: HTTP %s", status)
+                return None
         except Exception as e:
-            print(f"[OpenRouter] Model list error: {str(e)}")
+            logger.error("Model list error: %s", e)
             return None
-    
-    # Legacy sync methods ------------------------------------------------------
-    def chat_completion(self, messages, model):
-        """Synchronous version (DEPRECATED - prefer async)
-        
-        Warning:
-            This method blocks the event loop. Only use for compatibility with
-            legacy systems that can't support async/await.
-        """
-        import requests
-        url = f"{self.BASE_URL}/chat/completions"
-        data = {
-            "model": model,
-            "messages": messages,
-            "max_tokens": 1000  # Limit response size to avoid timeouts
-        }
-        
-        try:
-            print(f"Sending request to {url}")
-            print(f"Using model: {model}")
-            response = requests.post(
-                url, 
-                headers=self.headers, 
-                data=json.dumps(data),
-                timeout=60  # 60 second timeout
-            )
-            
-            print(f"Response status: {response.status_code}")
-            if hasattr(response, 'text') and response.text:
-                print(f"Response preview: {response.text[:200]}...")
-            
-            return response
-        except requests.exceptions.Timeout:
-            print("Request timed out")
-            # Create a mock response object with timeout information
-            mock_response = requests.Response()
-            mock_response.status_code = 408
-            mock_response._content = b'{"error": {"message": "Request timed out"}}'
-            return mock_response
-        except requests.exceptions.RequestException as e:
-            print(f"Request exception: {str(e)}")
-            # Create a mock response object with error information
-            mock_response = requests.Response()
-            mock_response.status_code = 500
-            mock_response._content = f'{{"error": {{"message": "Request failed: {str(e)}"}}}}'.encode('utf-8')
-            return mock_response
-    
-    def get_models(self):
-        """Synchronous model list (DEPRECATED - prefer async)
-        
-        Note:
-            This method may cause performance issues in async contexts
-        """
-        import requests
-        url = f"{self.BASE_URL}/models"
-        response = requests.get(url, headers=self.headers)
-        return response
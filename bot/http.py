@@ -0,0 +1,51 @@
+"""
+Shared HTTP Session
+
+Provides one application-wide aiohttp session so every subsystem (OpenRouter
+calls, attachment downloads, ...) shares the same connection pool, DNS cache
+and keep-alive sockets.
+"""
+import asyncio
+import aiohttp
+
+# Connection pool tuning. aiohttp's default keepalive (15s) drops sockets
+# between chat turns, so keep them warm for a typical conversation gap.
+CONNECTOR_OPTIONS = {
+    "limit": 100,
+    "limit_per_host": 32,
+    "keepalive_timeout": 75,
+    "enable_cleanup_closed": True,
+    "ttl_dns_cache": 300,
+}
+
+_session = None  # Shared aiohttp.ClientSession, created lazily
+_session_loop = None  # Event loop the session is bound to
+
+
+def get_session():
+    """Return the shared session, creating it on first use.
+
+    Must be called from a coroutine: the session is bound to the running
+    event loop and is recreated if it was closed or the loop changed.
+
+    Returns:
+        aiohttp.ClientSession: Application-wide pooled session
+    """
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        _session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=60),
+            connector=aiohttp.TCPConnector(**CONNECTOR_OPTIONS)
+        )
+        _session_loop = loop
+    return _session
+
+
+async def close_session():
+    """Close the shared session and release pooled connections."""
+    global _session, _session_loop
+    if _session is not None and not _session.closed:
+        await _session.close()  # Also closes the owned connector
+    _session = None
+    _session_loop = None
@@ -5,15 +5,22 @@ Handles bot initialization, command processing, and message interactions.
 Integrates with OpenRouter API for AI responses and maintains conversation context.
 """
 import asyncio
+import logging
+import re
 import discord
 from discord.ext import commands
 import shutil
+import sys
 import json
 import aiohttp
+from aiolimiter import AsyncLimiter
 from api.context_manager import ContextManager
 from api.openrouter import OpenRouterAPI  # We'll modify this class too
+from bot.http import close_session
 from bot.ui import ModelListView
 
+logger = logging.getLogger(__name__)
+
 class Sora:
     """Main Discord bot class handling interactions and AI integration.
     
@@ -25,6 +32,12 @@ class Sora:
         channel_id (int): Restricted channel for bot responses
         default_model (str): Default AI model for responses
     """
+
+    # Code fences at the start of a line (group 1 = language) or paragraph breaks
+    _SPLIT_RE = re.compile(r"^```([^\n]*)(?:\n|$)|\n\n", re.MULTILINE)
+    _FENCE_CLOSE = "\n```"
+    # Zero-width split point after every space or newline
+    _WORD_BREAK_RE = re.compile(r"(?<=[ \n])")
     
     def __init__(self, token, api_key):
         """Initialize bot with credentials and dependencies.
@@ -39,9 +52,25 @@ class Sora:
         self.token = token
         self.channel_id = 874348504502370331
         self.allow_user_model_selection = False
-        self.default_model = "google/gemini-2.0-flash-lite-preview-02-05:free"
+        # Discord allows 5 messages per 5 seconds per channel. Every bot message in a
+        # channel shares one bucket: bursts of 5, then one per second on average.
+        self.MAX_CHANNEL_LIMITERS = 100  # Limiters kept before drained ones are dropped
+        self._channel_limiters = {}  # {channel_id: AsyncLimiter}
+        self._model_chunks_cache = None  # (models payload, formatted model_chunks)
         self.setup()
 
+    @property
+    def default_model(self):
+        """str: Model used for users without their own preference.
+        
+        Stored on the context manager so ``get_user_model`` resolves it directly.
+        """
+        return self.context_manager.DEFAULT_MODEL
+
+    @default_model.setter
+    def default_model(self, model):
+        self.context_manager.DEFAULT_MODEL = model
+
     def setup(self):
         """Configure bot event handlers and slash commands."""
         @self.bot.event
@@ -52,18 +81,25 @@ class Sora:
             # Calculate the padding needed to center the message
             padding = (terminal_width - 60) // 2
 
-            print("\n" + " " * padding + "\033[94m╔══════════════════════════════════════════════════════╗\033[0m")
-            print(" " * padding + "\033[94m║\033[0m                                                      \033[94m║\033[0m")
-            print(" " * padding + "\033[94m║\033[0m                   \033[1m\033[96mSoul's Assistant\033[0m                   \033[94m║\033[0m")
-            print(" " * padding + "\033[94m║\033[0m                                                      \033[94m║\033[0m")  # Fixed empty row
-            print(" " * padding + "\033[94m╠══════════════════════════════════════════════════════╣\033[0m")
-            print(" " * padding + "\033[94m║\033[0m                                                      \033[94m║\033[0m")
-            print(" " * padding + f"\033[94m║\033[0m \033[1m\033[96mLogged in as:\033[0m \033[96mSoul\033[0m                                   \033[94m║\033[0m")  # Fixed spacing
-            print(" " * padding + f"\033[94m║\033[0m \033[1m\033[96mUser ID:\033[0m      \033[96m{self.bot.user.id}\033[0m                    \033[94m║\033[0m")  # Fixed spacing
-            print(" " * padding + "\033[94m║\033[0m                                                      \033[94m║\033[0m")
-            print(" " * padding + "\033[94m╚══════════════════════════════════════════════════════╝\033[0m")
-            print("\n")
-            print(" " * padding + "\033[96m         Let's engage in delightful conversations! \033[0m\n")
+            pad = " " * padding
+            banner = "\n".join([
+                "",
+                pad + "\033[94m╔══════════════════════════════════════════════════════╗\033[0m",
+                pad + "\033[94m║\033[0m                                                      \033[94m║\033[0m",
+                pad + "\033[94m║\033[0m                   \033[1m\033[96mSoul's Assistant\033[0m                   \033[94m║\033[0m",
+                pad + "\033[94m║\033[0m                                                      \033[94m║\033[0m",  # Fixed empty row
+                pad + "\033[94m╠══════════════════════════════════════════════════════╣\033[0m",
+                pad + "\033[94m║\033[0m                                                      \033[94m║\033[0m",
+                pad + f"\033[94m║\033[0m \033[1m\033[96mLogged in as:\033[0m \033[96mSoul\033[0m                                   \033[94m║\033[0m",  # Fixed spacing
+                pad + f"\033[94m║\033[0m \033[1m\033[96mUser ID:\033[0m      \033[96m{self.bot.user.id}\033[0m                    \033[94m║\033[0m",  # Fixed spacing
+                pad + "\033[94m║\033[0m                                                      \033[94m║\033[0m",
+                pad + "\033[94m╚══════════════════════════════════════════════════════╝\033[0m",
+                "\n",
+                pad + "\033[96m         Let's engage in delightful conversations! \033[0m\n",
+            ])
+            # One write instead of a print() per line
+            sys.stdout.write(banner + "\n")
+            sys.stdout.flush()
 
 
             await self.bot.tree.sync()  # Sync slash commands
@@ -91,23 +127,7 @@ class Sora:
             # Use the async version of get_models
             models_data = await self.api.get_models_async()
             if models_data:
-                models = models_data["data"]
-                
-                # Format the model list with custom styling
-                model_list = []
-                for model in models:
-                    # Truncate the description if it exceeds 100 characters
-                    description = model['description'][:100] + "..." if len(model['description']) > 100 else model['description']
-                    
-                    model_info = (
-                        f"🤖 **{model['name']}**\n"
-                        f"  ╰ *Model ID:* `{model['id']}`\n"
-                    )
-                    model_list.append(model_info)
-                
-                # Split the model list into chunks of 5 models per page
-                chunk_size = 5
-                model_chunks = [model_list[i:i+chunk_size] for i in range(0, len(model_list), chunk_size)]
+                model_chunks = self._get_model_chunks(models_data)
                 
                 # Create the paginated embed
                 embed = discord.Embed(
@@ -118,7 +138,7 @@ class Sora:
                 
                 def update_embed(page):
                     embed.clear_fields()
-                    embed.add_field(name="Models", value="\n".join(model_chunks[page]), inline=False)
+                    embed.add_field(name="Models", value=model_chunks[page], inline=False)
                     embed.set_footer(text=f"Page {page + 1}/{len(model_chunks)}")
                 
                 update_embed(0)
@@ -178,6 +198,7 @@ class Sora:
             
             Handles:
             - Channel restrictions
+            - Per-user serialization of turns
             - Context management
             - Async response generation
             - Error handling
@@ -191,58 +212,193 @@ class Sora:
             user_id = message.author.id
             question = message.content
 
-            messages = self.context_manager.get_context(user_id)
-            messages.append({"role": "user", "content": question})
+            # One turn at a time per user so replies build on consistent context
+            async with self.context_manager.lock(user_id):
+                # Pre-encoded history plus the new question, ready to send
+                messages = self.context_manager.get_context_payload(user_id, question)
 
-            user_model = self.context_manager.get_user_model(user_id)
-            if not user_model:
-                user_model = self.default_model
+                user_model = self.context_manager.get_user_model(user_id)
 
-            # Show typing indicator
-            async with message.channel.typing():
-                try:
-                    # Use the async version of chat_completion
-                    response_data = await self.api.chat_completion_async(messages, user_model)
+                # Show typing indicator
+                async with message.channel.typing():
+                    try:
+                        # Use the async version of chat_completion
+                        response_data = await self.api.chat_completion_async(messages, user_model)
                     
-                    if response_data and "choices" in response_data:
-                        ai_response = response_data["choices"][0]["message"]["content"]
+                        if response_data and "choices" in response_data:
+                            ai_response = response_data["choices"][0]["message"]["content"]
                         
-                        # Update the context
-                        self.context_manager.update_context(user_id, question, ai_response)
+                            # Update the context
+                            self.context_manager.update_context(user_id, question, ai_response)
                         
-                        # Split the response into chunks based on natural boundaries
-                        chunks = self.smart_split_text(ai_response, 1900)  # 1900 to be safe
+                            # Split the response into chunks based on natural boundaries
+                            chunks = self.smart_split_text(ai_response, 1900)  # 1900 to be safe
                         
-                        # Send first chunk as a direct reply
-                        first_msg = await message.reply(chunks[0])
+                            # Send first chunk as a direct reply
+                            first_msg = await self._reply(message, chunks[0])
                         
-                        # Send remaining chunks as followups
-                        # In your on_message function, replace the for loop with:
-                        for chunk in chunks[1:]:
-                            await asyncio.sleep(1)  # Avoid rate limiting
-                            # Additional safety check
-                            if len(chunk) > 2000:
-                                sub_chunks = [chunk[i:i+1900] for i in range(0, len(chunk), 1900)]
-                                for sub_chunk in sub_chunks:
-                                    await message.channel.send(sub_chunk, reference=first_msg)
-                                    await asyncio.sleep(0.5)
-                            else:
-                                await message.channel.send(chunk, reference=first_msg)
-                    else:
-                        error_message = "An error occurred while processing your request."
-                        if response_data and "error" in response_data:
-                            error_message = f"Error: {response_data['error'].get('message', 'Unknown error')}"
-                        await message.reply(error_message)
+                            # Send remaining chunks as followups, in order
+                            # (smart_split_text already caps every chunk at 1900)
+                            for chunk in chunks[1:]:
+                                await self._send_chunk(message.channel, chunk, first_msg)
+                        else:
+                            error_message = "An error occurred while processing your request."
+                            if response_data and "error" in response_data:
+                                error_message = f"Error: {response_data['error'].get('message', 'Unknown error')}"
+                            await self._reply(message, error_message)
                 
-                except Exception as e:
-                    print(f"Error in on_message: {str(e)}")
-                    import traceback
-                    traceback.print_exc()
-                    await message.reply("An error occurred while processing your request. Please try again later.")
+                    except Exception:
+                        logger.exception("Error in on_message")
+                        await self._reply(message, "An error occurred while processing your request. Please try again later.")
+
+    def _get_model_chunks(self, models_data):
+        """Format the model catalog into pages for the /list_models embed.
+        
+        The result is cached for as long as the API keeps returning the same
+        (TTL-cached) catalog object, so repeat invocations skip formatting.
+        
+        Args:
+            models_data (dict): Payload from ``OpenRouterAPI.get_models_async``
+            
+        Returns:
+            list: Pre-joined page strings, 5 models per page
+        """
+        if self._model_chunks_cache and self._model_chunks_cache[0] is models_data:
+            return self._model_chunks_cache[1]
+        
+        models = models_data["data"]
+        
+        # Format the model list with custom styling
+        model_list = []
+        for model in models:
+            model_info = (
+                f"🤖 **{model['name']}**\n"
+                f"  ╰ *Model ID:* `{model['id']}`\n"
+            )
+            model_list.append(model_info)
+        
+        # Split the model list into chunks of 5 models per page
+        chunk_size = 5
+        # Join each page once here instead of on every paginator click
+        model_chunks = ["\n".join(model_list[i:i+chunk_size]) for i in range(0, len(model_list), chunk_size)]
+        self._model_chunks_cache = (models_data, model_chunks)
+        return model_chunks
+
+    def _channel_limiter(self, channel):
+        """Get the limiter pacing the bot's messages in a channel.
+        
+        Args:
+            channel (discord.abc.Messageable): Channel the bot posts in
+            
+        Returns:
+            AsyncLimiter: Shared by every reply and followup in the channel
+        """
+        limiter = self._channel_limiters.get(channel.id)
+        if limiter is None:
+            if len(self._channel_limiters) >= self.MAX_CHANNEL_LIMITERS:
+                # A drained limiter behaves like a new one, so idle channels are safe to forget
+                for channel_id, idle in list(self._channel_limiters.items()):
+                    if idle.has_capacity(idle.max_rate):
+                        del self._channel_limiters[channel_id]
+            limiter = self._channel_limiters[channel.id] = AsyncLimiter(5, 5)
+        return limiter
+
+    async def _reply(self, message, content):
+        """Reply to a message without exceeding Discord's rate limit.
+        
+        Args:
+            message (discord.Message): Message to reply to
+            content (str): Reply text
+            
+        Returns:
+            discord.Message: The sent reply
+        """
+        async with self._channel_limiter(message.channel):
+            return await message.reply(content)
+
+    async def _send_chunk(self, channel, content, reference):
+        """Send one followup chunk without exceeding Discord's rate limit.
+        
+        Args:
+            channel (discord.abc.Messageable): Channel to post in
+            content (str): Chunk text
+            reference (discord.Message): Message the chunk replies to
+        """
+        async with self._channel_limiter(channel):
+            await channel.send(content, reference=reference)
+
+    @classmethod
+    def _iter_segments(cls, text):
+        """Yield the pieces ``smart_split_text`` may cut between.
+
+        Cuts fall after paragraph breaks and closing fences, and before
+        opening fences, so a chunk never ends on a dangling opening fence.
+
+        Yields:
+            tuple: (segment, in_code, lang, fence_line) where ``in_code`` is
+                the code block state at the end of the segment, ``lang`` is the
+                language of the most recent code block and ``fence_line`` is
+                True when the segment is nothing but a closing fence line
+        """
+        in_code = False
+        lang = ""
+        pos = 0
+        for match in cls._SPLIT_RE.finditer(text):
+            fence_lang = match.group(1)
+            if fence_lang is not None and not in_code:
+                # Opening fence starts the next segment
+                if match.start() > pos:
+                    yield text[pos:match.start()], False, "", False
+                pos = match.start()
+                in_code, lang = True, fence_lang.strip()
+                continue
+            fence_line = fence_lang is not None and match.start() == pos
+            if fence_lang is not None:
+                in_code = False
+            yield text[pos:match.end()], in_code, lang, fence_line
+            pos = match.end()
+        if pos < len(text):
+            yield text[pos:], in_code, lang, False
+
+    @classmethod
+    def _split_words(cls, text, max_length):
+        """Break an oversized paragraph into pieces at spaces and line breaks.
+        
+        Args:
+            text (str): Paragraph to split
+            max_length (int): Longest piece to produce (a single longer word
+                is left whole for the final force-split)
+            
+        Returns:
+            list: Pieces that concatenate back to ``text``
+        """
+        pieces = []
+        temp_parts = []
+        temp_len = 0
+        # Each word keeps the space or newline that follows it
+        for word in cls._WORD_BREAK_RE.split(text):
+            if not word:
+                continue
+            if temp_parts and temp_len + len(word) > max_length:
+                carry = []
+                if word.startswith("```") and len(temp_parts) > 1:
+                    # A piece may start a chunk, where "```" would read as a fence
+                    carry = [temp_parts.pop()]
+                pieces.append("".join(temp_parts))
+                temp_parts = carry
+                temp_len = sum(map(len, carry))
+            temp_parts.append(word)
+            temp_len += len(word)
+        pieces.append("".join(temp_parts))
+        return pieces
 
     def smart_split_text(self, text, max_length):
         """Split long messages while preserving markdown formatting.
         
+        Walks the text once, cutting at paragraph breaks and code fences. A
+        code block that spans two chunks is closed at the end of the first
+        and reopened with its language at the start of the next.
+        
         Args:
             text (str): Message content to split
             max_length (int): Discord message character limit
@@ -250,105 +406,87 @@ class Sora:
         Returns:
             list: Chunked text preserving code blocks and markdown
         """
-        """Split text into chunks while preserving markdown and code blocks."""
         if len(text) <= max_length:
             return [text]
         
+        # Leave room for the fence that closes a code block at a chunk boundary
+        budget = max_length - len(self._FENCE_CLOSE)
         chunks = []
-        current_chunk = ""
-        code_block_open = False
-        code_block_lang = ""
+        parts = []
+        size = 0
+        in_code = False  # Whether the text in parts ends inside a code block
+        lang = ""
+        oversized = False  # Only a single word longer than the budget sets this
         
-        # Split by paragraphs first
-        paragraphs = text.split('\n\n')
+        def emit():
+            nonlocal oversized
+            chunk = "".join(parts).strip()
+            if in_code:
+                chunk += self._FENCE_CLOSE
+            if chunk:
+                chunks.append(chunk)
+                oversized = oversized or len(chunk) > max_length
         
-        for paragraph in paragraphs:
-            # Check if adding this paragraph would exceed the limit
-            if len(current_chunk) + len(paragraph) + 2 > max_length:
-                # If we're in a code block, close it properly
-                if code_block_open:
-                    current_chunk += "\n```"
-                    code_block_open = False
-                
-                # Add the current chunk to our list
-                chunks.append(current_chunk.strip())
-                
-                # Start a new chunk
-                current_chunk = ""
-                
-                # If we were in a code block and have a language, open a new one
-                if code_block_lang:
-                    current_chunk = f"```{code_block_lang}\n"
-                    code_block_open = True
-            
-            # Count code block markers in this paragraph
-            markers = paragraph.count('```')
-            
-            # Process code block markers
-            if markers > 0:
-                # If odd number of markers, this paragraph crosses a code block boundary
-                if markers % 2 != 0:
-                    code_block_open = not code_block_open
-                    
-                    # If opening a code block, try to extract the language
-                    if code_block_open and '```' in paragraph:
-                        marker_pos = paragraph.find('```')
-                        # Extract language if specified
-                        if marker_pos + 3 < len(paragraph) and paragraph[marker_pos+3:].strip() and not paragraph[marker_pos+3:].startswith('\n'):
-                            code_block_lang = paragraph[marker_pos+3:].split('\n')[0].strip()
-            
-            # The paragraph itself might be too long, need to split it
-            if len(paragraph) > max_length:
-                # If we have anything in the current chunk, add it first
-                if current_chunk:
-                    if code_block_open:
-                        current_chunk += "\n```"
-                    chunks.append(current_chunk.strip())
-                    current_chunk = ""
-                    if code_block_lang:
-                        current_chunk = f"```{code_block_lang}\n"
-                        code_block_open = True
-                
-                # Split the paragraph into smaller chunks
-                words = paragraph.split(' ')
-                temp_chunk = ""
-                
-                for word in words:
-                    if len(temp_chunk) + len(word) + 1 > max_length:
-                        if code_block_open:
-                            temp_chunk += "\n```"
-                        chunks.append(temp_chunk.strip())
-                        temp_chunk = ""
-                        if code_block_open:
-                            temp_chunk = f"```{code_block_lang}\n"
-                    temp_chunk += word + " "
-                
-                # Add any remaining content from temp_chunk
-                if temp_chunk:
-                    current_chunk += temp_chunk
-            else:
-                # Add the paragraph to the current chunk
-                current_chunk += paragraph + "\n\n"
+        def add(piece, piece_in_code, piece_lang, fence_line=False):
+            nonlocal parts, size, in_code, lang
+            if parts and size + len(piece) > budget:
+                emit()
+                if in_code and fence_line:
+                    # Lone closing fence: emit() already closed this block
+                    parts, size, in_code, lang = [], 0, False, ""
+                    return
+                # Carry an open code block over into the next chunk
+                parts = [f"```{lang}\n"] if in_code else []
+                size = len(parts[0]) if parts else 0
+            parts.append(piece)
+            size += len(piece)
+            in_code, lang = piece_in_code, piece_lang
         
-        # Add the last chunk if it's not empty
-        if current_chunk.strip():
-            # If we're still in a code block, close it
-            if code_block_open:
-                current_chunk += "\n```"
-            chunks.append(current_chunk.strip())
+        for segment, segment_in_code, segment_lang, fence_line in self._iter_segments(text):
+            # Inside a code block the segment may land after a reopened fence
+            limit = budget - len(f"```{lang}\n") if in_code else budget
+            if len(segment) <= limit:
+                add(segment, segment_in_code, segment_lang, fence_line)
+                continue
+            # The paragraph itself is too long, split it at word boundaries.
+            # Everything before its last piece sits inside any code block it
+            # opens or closes.
+            inner_in_code = in_code or segment_in_code or segment.startswith("```")
+            pieces = self._split_words(segment, budget - len(f"```{segment_lang}\n"))
+            for piece in pieces[:-1]:
+                add(piece, inner_in_code, segment_lang)
+            # The closing fence can end up as a piece of its own
+            closes_alone = inner_in_code and not segment_in_code and pieces[-1].strip() == "```"
+            add(pieces[-1], segment_in_code, segment_lang, closes_alone)
+        emit()
         
-        # Final verification: ensure no chunk exceeds max_length
-        verified_chunks = []
-        for chunk in chunks:
-            if len(chunk) <= max_length:
-                verified_chunks.append(chunk)
-            else:
-                # If we still have an oversized chunk, force-split it
-                for i in range(0, len(chunk), max_length):
-                    verified_chunks.append(chunk[i:i+max_length])
+        if not oversized:
+            return chunks
         
-        return verified_chunks
+        # Final safety net: force-split any single word longer than the limit
+        return [
+            chunk[i:i + max_length]
+            for chunk in chunks
+            for i in range(0, len(chunk), max_length)
+        ]
 
     def run(self):
-        """Start the Discord bot connection."""
-        self.bot.run(self.token)
+        """Start the Discord bot connection.
+
+        Mirrors ``commands.Bot.run`` but closes the shared HTTP sessions on
+        the bot's event loop once the bot shuts down.
+        """
+        async def runner():
+            async with self.bot:
+                try:
+                    await self.bot.start(self.token)
+                finally:
+                    await self.api.aclose()
+                    await close_session()
+
+        discord.utils.setup_logging()
+        try:
+            asyncio.run(runner())
+        except KeyboardInterrupt:
+            # Ctrl+C is the normal way to stop the bot
+            return
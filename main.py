@@ -2,7 +2,6 @@ import os
 from dotenv import load_dotenv
 import discord
 from discord.ext import commands
-import requests
 import json
 from bot.sora import Sora
 
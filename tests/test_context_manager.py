@@ -0,0 +1,27 @@
+"""Tests for ContextManager history compaction."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+orjson = pytest.importorskip("orjson")
+
+from api.context_manager import SUMMARY_PREFIX, ContextManager
+
+
+def test_compaction_tolerates_none_reply():
+    manager = ContextManager()
+    for turn in range(14):
+        manager.update_context(1, f"question {turn}", f"answer {turn}")
+    manager.update_context(1, "question with no answer", None)
+    for turn in range(25):
+        manager.update_context(1, f"later question {turn}", f"later answer {turn}")
+
+    history = list(manager.get_context(1))
+    assert len(history) <= manager.COMPACT_THRESHOLD
+    assert history[0]["role"] == "system"
+    assert history[0]["content"].startswith(SUMMARY_PREFIX)
+    # The cached encoding still matches the stored history
+    payload = orjson.loads(manager.get_context_payload(1, "next"))
+    assert payload[:-1] == history
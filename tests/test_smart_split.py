@@ -0,0 +1,85 @@
+"""Invariant checks for Sora.smart_split_text."""
+import os
+import random
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip("discord")
+
+from bot.sora import Sora
+
+FENCE_LINE = re.compile(r"^```", re.MULTILINE)
+
+
+def split(text, max_length):
+    # smart_split_text doesn't touch instance state, so skip the bot setup
+    return Sora.smart_split_text(Sora.__new__(Sora), text, max_length)
+
+
+def strip_markup(text):
+    """Drop whitespace and fence lines the splitter may add or move."""
+    return re.sub(r"^```\w*$|\s", "", text, flags=re.MULTILINE)
+
+
+def assert_invariants(text, max_length):
+    chunks = split(text, max_length)
+    for chunk in chunks:
+        assert len(chunk) <= max_length, chunk
+        assert len(FENCE_LINE.findall(chunk)) % 2 == 0, chunk
+    assert "".join(map(strip_markup, chunks)) == strip_markup(text)
+    return chunks
+
+
+def test_short_text_is_returned_whole():
+    assert split("hello", 100) == ["hello"]
+
+
+def test_inline_fence_word_inside_code_block_is_kept():
+    text = "```text\n" + "word " * 30 + "```md " + "tail " * 30 + "\n```"
+    chunks = assert_invariants(text, 67)
+    assert any("```md" in chunk for chunk in chunks)
+
+
+def test_reopened_fence_counts_against_the_limit():
+    text = (
+        "```python\n" + "a = 1\n" * 10 + "\n" + "b = 2 " * 15 + "x\n\n"
+        + "c = 3\n" * 5 + "```\n\nafter"
+    )
+    assert_invariants(text, 100)
+
+
+def test_space_free_code_lines_split_at_newlines():
+    rows = "\n".join(f"row{i},val{i},ok" for i in range(200))
+    text = f"```csv\n{rows}\n```"
+    chunks = assert_invariants(text, 1900)
+    assert len(chunks) > 1
+    assert all(chunk.startswith("```csv\n") for chunk in chunks)
+
+
+@pytest.mark.parametrize("max_length", [100, 300, 1900])
+def test_random_markdown_keeps_invariants(max_length):
+    rng = random.Random(max_length)
+    words = ["alpha", "beta", "gamma", "x" * 30, "delta"]
+
+    def paragraph():
+        return " ".join(rng.choice(words) for _ in range(rng.randint(5, 80)))
+
+    def code_line():
+        # Mix prose-like lines with space-free ones (CSV rows, minified JSON)
+        if rng.random() < 0.5:
+            return paragraph()
+        # Kept under the smallest budget, longer tokens are force-split by design
+        return ",".join(rng.choice(words) for _ in range(rng.randint(1, 2)))
+
+    for _ in range(100):
+        blocks = []
+        for _ in range(rng.randint(1, 40)):
+            if rng.random() < 0.2:
+                lines = "\n".join(code_line() for _ in range(rng.randint(1, 40)))
+                blocks.append(f"```py\n{lines}\n```")
+            else:
+                blocks.append(paragraph())
+        assert_invariants("\n\n".join(blocks), max_length)